@@ -1,17 +1,19 @@
 from ps_opt._base import _Base
+import numbers
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import cross_val_score
+from sklearn.metrics import get_scorer
+from joblib import Parallel, delayed
 
 
 class _Initialization(_Base):
     """
     Class '_Initialization' consist of a single method '_initialize',
     and inherent class '_Base' as the sole parent class to inherent class
-    method '_system_datetime'. 2 arguments are required to instantiate
-    class '_Initialization'.
+    method '_system_datetime'. 2 arguments and 1 optional argument are
+    required to instantiate class '_Initialization'.
     """
-    def __init__(self, n_particles, verbosity):
+    def __init__(self, n_particles, verbosity, random_state=None):
         """
         Parameters
         ----------
@@ -22,18 +24,23 @@ class _Initialization(_Base):
         verbosity : int
                     'verbosity' controls if any messages are being print
                     out during feature selection processes.
+
+        random_state : int, numpy.random.Generator or None, default=None
+                    Seed of the random number generator that draws the
+                    initial particles, or the generator itself.
         """
-        if not isinstance(n_particles, int):
+        if not isinstance(n_particles, numbers.Integral):
             raise ValueError("Argument 'n_particles' only accept integer as "
                              "input.")
 
-        if not isinstance(verbosity, int):
+        if not isinstance(verbosity, numbers.Integral):
             raise ValueError("Argument 'verbosity' only accept integer as "
                              "input.")
 
         _Base.__init__(self)
         self.n_particles = n_particles
         self.verbosity = verbosity
+        self._rng = np.random.default_rng(random_state)
 
     def _initialize(self, X):
         """
@@ -62,8 +69,8 @@ class _Initialization(_Base):
             A variable that determines the velocities being calculated. The value of
             'global_best' is None when its first defined during initiation.
         ``global_best_particle``
-            A variable that store the row and columns numbers of the best particle
-            found during the evaluation phase.
+            A variable that store the row number and the packed selected features
+            of the best particle found during the evaluation phase.
         """
         if not isinstance(X, pd.core.frame.DataFrame) and not isinstance(X, np.ndarray):
             raise ValueError("Argument 'X' only accept 'pandas.core.frame.DataFrame' or 'numpy.ndarray' as input.")
@@ -72,8 +79,7 @@ class _Initialization(_Base):
             print(f"{self._system_datetime} Particle Swarm Feature Selection CV started.")
             print(f"{self._system_datetime} Initiate 'global_best', 'global_best_particle', 'particles' and 'velocities'.")
 
-        particles = np.random.random(size=(self.n_particles, X.shape[1]))
-        particles = pd.DataFrame(particles)
+        particles = self._rng.random(size=(self.n_particles, X.shape[1]))
         velocities = np.zeros(particles.shape)
         global_best = None
         global_best_particle = None
@@ -83,12 +89,13 @@ class _Initialization(_Base):
 
 class _Evaluation(_Base):
     """
-    Class '_Evaluation' consist of a single method '_evaluate_performance', and
-    inherent class '_Base' as the sole parent class to inherent class
-    method '_system_datetime'. 5 arguments are required to instantiate
-    class '_Evaluation'.
+    Class '_Evaluation' consist of 3 methods '_evaluate_performance',
+    '_encode_subsets' and '_decode_subset', and inherent class '_Base' as
+    the sole parent class to inherent class method '_system_datetime'.
+    5 arguments and 1 optional argument are required to instantiate class
+    '_Evaluation'.
     """
-    def __init__(self, estimator, cv, scoring, n_jobs, verbosity):
+    def __init__(self, estimator, cv, scoring, n_jobs, verbosity, random_state=None):
         """
         Parameters
         ----------
@@ -116,130 +123,280 @@ class _Evaluation(_Base):
             If ``None``, the ``score`` method of the estimator is used.
 
         n_jobs : int, default=-1
-            Number of jobs to run in parallel. At maximum there are
-            ``n_points`` times ``cv`` jobs available during each iteration.
+            Number of jobs to run in parallel. Particles are evaluated in
+            parallel, so at maximum there are ``n_particles`` jobs available
+            during each iteration.
 
         verbosity : int
                     'verbosity' controls if any messages are being print
                     out during feature selection processes.
+
+        random_state : int, numpy.random.Generator or None, default=None
+                    Seed of the random number generator that draws the
+                    selection thresholds, or the generator itself.
         """
 
-        if not isinstance(cv, int):
+        if not isinstance(cv, numbers.Integral):
             raise ValueError("Argument 'cv' only accept integer as input.")
 
         if not isinstance(scoring, str):
             raise ValueError("Argument 'cv' only accept string as input.")
 
-        if not isinstance(n_jobs, int):
+        if not isinstance(n_jobs, numbers.Integral):
             raise ValueError("Argument 'n_jobs' only accept integer as input.")
 
-        if not isinstance(verbosity, int):
+        if not isinstance(verbosity, numbers.Integral):
             raise ValueError("Argument 'verbosity' only accept integer as input.")
 
         _Base.__init__(self)
         self.estimator = estimator
         self.cv = cv
         self.scoring = scoring
-        self.candidates_score = {}
+        self._scorer = get_scorer(scoring)
+        self.subset_score = {}
+        self._cv_splits = None
+        self._thresholds = None
+        self._last_hash = None
+        self._rng = np.random.default_rng(random_state)
         self.n_jobs = n_jobs
         self.verbosity = verbosity
 
-    def _evaluate_performance(self, X, y, particles):
+    def _evaluate_performance(self, X, y, particles, thresholds=None):
         """
         Parameters
         ----------
-        X : pandas.core.frame.DataFrame or numpy.ndarray of shape (n_samples, n_features)
-            The data to fit.
+        X : numpy.ndarray of shape (n_samples, n_features)
+            The data to fit, preferably Fortran-contiguous so that
+            the columns of each particle can be selected cheaply.
 
-        y : array-like of shape (n_samples,) or (n_samples, n_outputs),
+        y : numpy.ndarray of shape (n_samples,) or (n_samples, n_outputs),
             The target variable to try to predict in the case of
             supervised learning.
 
-        particles : pandas.core.frame.DataFrame
+        particles : numpy.ndarray
                     The probability array of shape (n_particles, n_features), which contains
                     sets of different probabilities which determines if corresponding
                     features are being selected during the evaluation phase.
 
+        thresholds : numpy.ndarray or None, default=None
+                    The random array of shape (n_particles, n_features) that
+                    is compared with 'particles' to select features. If None,
+                    the thresholds are drawn during the evaluation phase.
+
         Returns
         -------
-        ``particles``
-            As described in 'Parameters' section.
-        ``velocities``
-            The velocity array of shape (n_particles, n_features), which is being
-            used to update the velocities of the particles. 'velocities'
-            will be calculated during the with the '_calculate_velocities' function
-            from class 'Communication'.
-        ``global_best``
-            A variable that determines the velocities being calculated. The value of
-            'global_best' is None when its first defined during initiation.
-        ``global_best_particle``
-            A variable that store the row and columns numbers of the best particle
-            found during the evaluation phase.
+        ``results``
+            The dictionary that uses a tuple of the row number and the packed
+            selected features of each particle evaluated during the current
+            iteration as key and stores the corresponding scores.
+        ``current_best``
+            The best score found during the current iteration, or None if no
+            particle selected any feature.
+        ``current_best_particle``
+            The row number and the packed selected features of the particle
+            with 'current_best' as score, or None if no particle selected any
+            feature.
         """
         if self.verbosity:
             print(f"{self._system_datetime} Evaluating particles:")
 
-        if isinstance(X, pd.core.frame.DataFrame):
-            X = X.to_numpy()
+        # selecting particles base on randomly generated probabilities from parent class 'Initialization'.
+        # each feature is a Bernoulli draw with its probability, the fallback thresholds are drawn into a reused
+        # buffer so that no float array is allocated per iteration.
+        if thresholds is None:
+            if self._thresholds is None or self._thresholds.shape != particles.shape:
+                self._thresholds = np.empty(particles.shape)
+            thresholds = self._rng.random(out=self._thresholds)
+        mask = thresholds < particles
+        has_features = mask.any(axis=1)
+        keys = self._encode_subsets(mask)
+        last_hash = self._last_hash if self._last_hash is not None else [None] * len(keys)
+
+        # if selected particle contains any features and the selected particle has not been evaluated before, evaluate the particle.
+        # scores are cached by the packed selected features only, so the same subset reached by another particle is not
+        # evaluated again, and particles whose selected features did not change since the last iteration skip the lookup.
+        # identical subsets sampled by several particles within the iteration are only evaluated once.
+        candidates = []
+        tasks = {}
+        for i, key in enumerate(keys):
+            if not has_features[i]:
+                continue
+
+            candidates.append((i, key))
+            is_unchanged = key == last_hash[i]
+            if not is_unchanged and key not in self.subset_score:
+                tasks.setdefault(key, i)
+
+        # particles are independent of each other, so they are evaluated in parallel while
+        # the folds of each particle are evaluated sequentially. the folds reuse a single estimator
+        # and the cached scorer of each particle instead of going through 'cross_val_score'.
+        estimator, scorer, cv_splits = self.estimator, self._scorer, self._cv_splits
+
+        def _score(X, y, particle):
+            # a run of consecutive columns is selected as a view, any other subset is gathered with a
+            # single copy, which is the fastest column selection on a Fortran-contiguous 'X'.
+            is_consecutive = particle[-1] - particle[0] + 1 == len(particle)
+            X_particle = X[:, particle[0]:particle[-1] + 1] if is_consecutive else X[:, particle]
+            model = estimator()
+            scores = []
+            for train, test in cv_splits:
+                model.fit(X_particle[train], y[train])
+                scores.append(scorer(model, X_particle[test], y[test]))
+
+            return np.mean(scores)
+
+        # joblib reports the progress at a throttled rate only when 'verbosity' is set, so a silent run
+        # does not pay any per-particle reporting cost.
+        scores = Parallel(n_jobs=self.n_jobs, verbose=self.verbosity)(
+            delayed(_score)(X, y, np.flatnonzero(mask[row])) for row in tasks.values()
+        )
+        for key, score in zip(tasks, scores):
+            self.subset_score[key] = score
+
+        # the keys are only remembered once their scores are stored, so that a failed evaluation
+        # does not mark unscored particles as unchanged.
+        self._last_hash = keys
+
+        # keep track of the best particle of the current iteration while collecting the results.
+        results = {}
+        current_best, current_best_particle = None, None
+        for i, key in candidates:
+            score = self.subset_score[key]
+            results[(i, key)] = score
+            if current_best is None or score > current_best:
+                current_best, current_best_particle = score, (i, key)
+
+        return results, current_best, current_best_particle
+
+    def _encode_subsets(self, mask):
+        """
+        Pack the selected features of each particle into a single key, which
+        is an integer if there are at most 64 features and bytes otherwise.
 
-        for i, vals in particles.iterrows():
-            # selecting particles base on randomly generated probabilities from parent class 'Initialization'.
-            is_selected = vals >= np.random.random()
-            particle = vals[is_selected].index
-            particle = tuple(particle)
+        Parameters
+        ----------
+        mask : numpy.ndarray
+                    The boolean array of shape (n_particles, n_features) that
+                    determines which features are selected by each particle.
 
-            # if selected particle contains any features and the selected particle has not been evaluated before, evaluate the particle.
-            is_any_particle = any(particle)
-            is_not_scored = particle not in self.candidates_score
-            if is_any_particle and is_not_scored:
-                cv_score = cross_val_score(
-                    estimator=self.estimator(),
-                    cv=self.cv,
-                    X=X[:, particle],
-                    y=y,
-                    scoring=self.scoring,
-                    n_jobs=self.n_jobs
-                )
+        Returns
+        -------
+        ``keys``
+            The list of packed keys of each particle.
+        """
+        packed = np.packbits(mask, axis=1, bitorder='little')
+        if mask.shape[1] > 64:
+            return [row.tobytes() for row in packed]
+
+        words = np.zeros((mask.shape[0], 8), dtype=np.uint8)
+        words[:, :packed.shape[1]] = packed
+        return words.view('<u8').ravel().tolist()
+
+    def _decode_subset(self, key, n_features):
+        """
+        Unpack a key generated by '_encode_subsets' back to the selected
+        features.
+
+        Parameters
+        ----------
+        key : int or bytes
+                    The packed key of the selected features.
 
-                self.candidates_score[(i, particle)] = cv_score.mean()
+        n_features : int
+                    The number of features of the data to fit.
 
-        results = pd.DataFrame([self.candidates_score], index=['score']).T
+        Returns
+        -------
+        ``particle``
+            The tuple of the column numbers of the selected features.
+        """
+        if isinstance(key, int):
+            key = key.to_bytes(8, 'little')
 
-        return results
+        bits = np.unpackbits(np.frombuffer(key, dtype=np.uint8), count=n_features, bitorder='little')
+        return tuple(np.flatnonzero(bits).tolist())
 
 
 class _Communication(_Base):
     """
-    Class '_Communication' consist of 2 methods '_update_global_best',
-    and '_calculate_velocities'. Class '_Communication' inherent class
-    '_Base' as the sole parent class to inherent class method
-    '_system_datetime'. 1 argument are required to instantiate class
-    '_Communication'.
+    Class '_Communication' consist of 3 methods '_update_personal_best',
+    '_update_global_best' and '_calculate_velocities'. Class
+    '_Communication' inherent class '_Base' as the sole parent class to
+    inherent class method '_system_datetime'. 1 argument and 1 optional
+    argument are required to instantiate class '_Communication'.
     """
-    def __init__(self, verbosity):
+    def __init__(self, verbosity, random_state=None):
         """
         Parameters
         ----------
         verbosity : int
                     'verbosity' controls if any messages are being print
                     out during feature selection processes.
+
+        random_state : int, numpy.random.Generator or None, default=None
+                    Seed of the random number generator that draws the
+                    random factors of the velocities, or the generator itself.
         """
-        if not isinstance(verbosity, int):
+        if not isinstance(verbosity, numbers.Integral):
             raise ValueError("Argument 'verbosity' only accept integer as input.")
 
         _Base.__init__(self)
         self.verbosity = verbosity
+        self.pbest_x = None
+        self.pbest_score = None
+        self._rng = np.random.default_rng(random_state)
 
-    def _update_global_best(self, evaluation_results, global_best, global_best_particle):
+    def _update_personal_best(self, evaluation_results, particles):
+        """
+        Update the best position and score found by each particle during
+        evaluation phase.
+
+        Parameters
+        ----------
+        evaluation_results : dict
+                      The dictionary that uses a tuple of the row number and
+                      the packed selected features of each particle as key and
+                      stores the corresponding scores evaluated.
+
+        particles : numpy.ndarray
+                    The probability array of shape (n_particles, n_features), which contains
+                    sets of different probabilities which determines if corresponding
+                    features are being selected during the evaluation phase.
+
+        Returns
+        -------
+        ``pbest_x``
+            The array of shape (n_particles, n_features) that stores the best
+            position found by each particle.
+        ``pbest_score``
+            The array of shape (n_particles,) that stores the score of the best
+            position found by each particle.
+        """
+        # the initial positions are the personal best of any particle that has not been scored yet.
+        if self.pbest_x is None:
+            self.pbest_x = particles.copy()
+            self.pbest_score = np.full(particles.shape[0], -np.inf)
+
+        for (i, _), score in evaluation_results.items():
+            if score > self.pbest_score[i]:
+                self.pbest_score[i] = score
+                self.pbest_x[i] = particles[i]
+
+        return self.pbest_x, self.pbest_score
+
+    def _update_global_best(self, current_best, current_best_particle, global_best, global_best_particle):
         """
         Update the global best variable found during evaluation phase.
 
         Parameters
         ----------
-        evaluation_results : pd.core.frame.DataFrame
-                      The scores array that uses a tuple of selected
-                      features as index and stores the corresponding
-                      scores evaluated.
+        current_best : float or None
+                      The best score found during the current iteration, which
+                      is None if no particle selected any feature.
+
+        current_best_particle : tuple or None
+                      The row number and the packed selected features of the
+                      particle with 'current_best' as score.
 
         global_best : float
                       A variable that determines the velocities being calculated.
@@ -248,8 +405,9 @@ class _Communication(_Base):
                       phase.
 
         global_best_particle : tuple
-                            A variable that store the row and columns numbers of
-                            the best particle found during the evaluation phase.
+                            A variable that store the row number and the packed
+                            selected features of the best particle found during
+                            the evaluation phase.
                             'global_best_particle' will be updated during the
                             communication phase.
 
@@ -263,40 +421,52 @@ class _Communication(_Base):
         if self.verbosity:
             print(f"\n{self._system_datetime} Update global best score and best particle.")
 
-        # get the current best particle and the current best score from evaluation results.
-        current_best_particle = evaluation_results.idxmax().iloc[0]
-        current_best = evaluation_results.max().iloc[0]
-
-        # if the global best score is not defined or a better particle is found,
-        # update the current best score and particle.
-        is_global_best_not_defined = global_best is None and global_best_particle is None
-        is_current_particle_better = global_best is None or global_best < current_best
-        if is_global_best_not_defined or is_current_particle_better:
+        # if the global best score is not defined or a better particle is found during the current
+        # iteration, update the global best score and particle. if no particle selected any feature
+        # during the current iteration, keep the global best as it is.
+        is_current_particle_better = current_best is not None and (global_best is None or global_best < current_best)
+        if is_current_particle_better:
             global_best = current_best
             global_best_particle = current_best_particle
 
         return global_best, global_best_particle
 
-    def _calculate_velocities(self, particles, global_best_particle, max_iter):
+    def _calculate_velocities(self, particles, velocities, pbest_x, gbest_x, w=0.7, c1=1.5, c2=1.5):
         """
-        Update the global best variable found during evaluation phase.
+        Calculate the new velocities of the particles with inertia, cognitive
+        and social terms, such that
+        ``v = w * v + c1 * r1 * (pbest_x - x) + c2 * r2 * (gbest_x - x)``.
 
         Parameters
         ----------
-        particles : pandas.core.frame.DataFrame
+        particles : numpy.ndarray
                     The probability array of shape (n_particles, n_features), which contains
                     sets of different probabilities which determines if corresponding
                     features are being selected during the evaluation phase.
 
-        global_best_particle : tuple
-                    A variable that store the row and columns numbers of
-                    the best particle found during the evaluation phase.
-                    'global_best_particle' will be updated during the
-                    communication phase.
+        velocities : numpy.ndarray
+                    The velocity array of shape (n_particles, n_features), which
+                    is overwritten in place with the new velocities.
+
+        pbest_x : numpy.ndarray
+                    The array of shape (n_particles, n_features) that stores the
+                    best position found by each particle.
+
+        gbest_x : numpy.ndarray
+                    The array of shape (n_features,) that stores the best position
+                    found by the swarm.
+
+        w : float, default=0.7
+                    The inertia weight that controls how much of the previous
+                    velocities are kept.
+
+        c1 : float, default=1.5
+                    The cognitive coefficient that controls the attraction of each
+                    particle towards its own best position.
 
-        max_iter : int
-                    Determines the maximum number of iterations or step size
-                    that particles or probabilities will be updated.
+        c2 : float, default=1.5
+                    The social coefficient that controls the attraction of each
+                    particle towards the best position of the swarm.
 
         Returns
         -------
@@ -309,7 +479,8 @@ class _Communication(_Base):
         if self.verbosity:
             print(f"{self._system_datetime} Calculate new velocities for particles.")
 
-        global_best_particle = particles.loc[global_best_particle[0]]
-        velocities = (global_best_particle - particles) / max_iter
+        r1 = self._rng.random(particles.shape)
+        r2 = self._rng.random(particles.shape)
+        velocities[:] = w * velocities + c1 * r1 * (pbest_x - particles) + c2 * r2 * (gbest_x - particles)
 
         return velocities
\ No newline at end of file
@@ -30,22 +30,33 @@ __version__ = '2.0.0'
 __author__ = 'Yuen Shing Yan Hindy'
 
 
+import numbers
+from contextlib import nullcontext
+import pandas as pd
+import numpy as np
+from sklearn.base import is_classifier
+from sklearn.model_selection import check_cv
+from joblib import parallel_backend
 from ps_opt._feature_selection_process import (
     _Initialization,
     _Evaluation,
     _Communication
 )
 
+# the maximum number of bytes used to draw the thresholds of all iterations up front.
+_THRESHOLDS_BUDGET = 2 ** 27
+
 
 class ParticleSwarmFeatureSelectionCV(_Initialization, _Evaluation, _Communication):
     """
     Class 'ParticleSwarmFeatureSelectionCV' consist of 1 method 'fit'.
     Class 'ParticleSwarmFeatureSelectionCV' inherent classes
     '_Initialization', '_Evaluation' and '_Communication' as the parent
-    classes to inherent class methods from them. 5 arguments and 2 optional
+    classes to inherent class methods from them. 5 arguments and 4 optional
     arguments are required to instantiate class 'ParticleSwarmFeatureSelectionCV'.
     """
-    def __init__(self, n_particles, estimator, cv, scoring, max_iter, n_jobs=-1, verbosity=0):
+    def __init__(self, n_particles, estimator, cv, scoring, max_iter, n_jobs=-1, verbosity=0, random_state=None,
+                 backend=None):
         """
         Parameters
         ----------
@@ -81,32 +92,53 @@ class ParticleSwarmFeatureSelectionCV(_Initialization, _Evaluation, _Communicati
             that particles or probabilities will be updated.
 
         n_jobs : int, default=-1
-            Number of jobs to run in parallel. At maximum there are
-            ``n_points`` times ``cv`` jobs available during each iteration.
+            Number of jobs to run in parallel. Particles are evaluated in
+            parallel, so at maximum there are ``n_particles`` jobs available
+            during each iteration.
 
         verbosity : int, default=0
             'verbosity' controls if any messages are being print
             out during feature selection processes.
+
+        random_state : int or None, default=None
+            Seed of the random number generator that draws the initial
+            particles, the selection thresholds and the velocity updates.
+            Pass an int for reproducible results.
+
+        backend : str or None, default=None
+            The joblib backend used to evaluate the particles in parallel.
+            If None, joblib's default process-based backend is used.
+            'threading' shares 'X' between the workers instead of copying it
+            to each of them, but only speeds up estimators whose fitting
+            releases the GIL for most of its run time.
         """
 
-        if not isinstance(n_particles, int):
+        if not isinstance(n_particles, numbers.Integral):
             raise ValueError("Argument 'n_particles' only accept integer as input.")
 
-        if not isinstance(cv, int):
+        if not isinstance(cv, numbers.Integral):
             raise ValueError("Argument 'cv' only accept integer as input.")
 
         if not isinstance(scoring, str):
             raise ValueError("Argument 'scoring' only accept string as input.")
 
-        if not isinstance(max_iter, int):
+        if not isinstance(max_iter, numbers.Integral):
             raise ValueError("Argument 'max_iter' only accept integer as input.")
 
-        if not isinstance(verbosity, int):
+        if not isinstance(verbosity, numbers.Integral):
             raise ValueError("Argument 'verbosity' only accept integer as input.")
 
-        _Initialization.__init__(self, n_particles, verbosity)
-        _Evaluation.__init__(self, estimator, cv, scoring, n_jobs, verbosity)
-        _Communication.__init__(self, verbosity)
+        if random_state is not None and not isinstance(random_state, numbers.Integral):
+            raise ValueError("Argument 'random_state' only accept integer or None as input.")
+
+        if backend is not None and not isinstance(backend, str):
+            raise ValueError("Argument 'backend' only accept string or None as input.")
+
+        # a single generator is shared by all processes, so that they draw from one random stream.
+        rng = np.random.default_rng(random_state)
+        _Initialization.__init__(self, n_particles, verbosity, rng)
+        _Evaluation.__init__(self, estimator, cv, scoring, n_jobs, verbosity, rng)
+        _Communication.__init__(self, verbosity, rng)
 
         self.best_score_ = None
         self.best_features_ = None
@@ -119,23 +151,65 @@ class ParticleSwarmFeatureSelectionCV(_Initialization, _Evaluation, _Communicati
         self.first_iter = max_iter
         self.n_jobs = n_jobs
         self.verbosity = verbosity
+        self.random_state = random_state
+        self.backend = backend
 
     def fit(self, X, y):
         particles, velocities, global_best, global_best_particle = self._initialize(X)
-        while self.n_iter > 0:
-            if self.n_iter != self.first_iter and self.verbosity:
-                print(f"{self._system_datetime} Update particles' velocities.")
-
-            particles += velocities
-            results = self._evaluate_performance(X, y, particles)
-            global_best, global_best_particle = self._update_global_best(results, global_best, global_best_particle)
-            velocities = self._calculate_velocities(particles, global_best_particle, self.n_iter)
-
-            if self.verbosity:
-                print(f"{self._system_datetime} Iteration {self.first_iter - self.n_iter} is done.")
-
-            self.n_iter -= 1
 
-        self.best_proba_ = particles.loc[global_best_particle[0], list(global_best_particle[1])].to_list()
-        self.best_features_ = global_best_particle[1]
+        # convert 'X' once to a Fortran-contiguous array, so that selecting the columns of a
+        # particle reads contiguous memory instead of converting 'X' on every iteration.
+        X = np.asfortranarray(X.to_numpy() if isinstance(X, pd.core.frame.DataFrame) else X)
+        y = np.asarray(y)
+
+        # compute the cross-validation splits once, so that they are reused by every particle
+        # in every iteration instead of being recomputed by each 'cross_val_score' call.
+        cv = check_cv(self.cv, y, classifier=is_classifier(self.estimator()))
+        self._cv_splits = list(cv.split(X, y))
+
+        # draw the thresholds of all iterations in a single call if they fit in memory,
+        # otherwise they are drawn once per iteration during the evaluation phase.
+        thresholds_shape = (self.n_iter,) + particles.shape
+        thresholds = None
+        if np.prod(thresholds_shape) * 8 < _THRESHOLDS_BUDGET:
+            thresholds = self._rng.random(thresholds_shape)
+
+        # evaluate the particles with the chosen joblib backend during the whole search, with the
+        # threading backend the workers share 'X' instead of receiving a copy of it on every iteration.
+        backend = nullcontext() if self.backend is None else parallel_backend(self.backend, n_jobs=self.n_jobs)
+        with backend:
+            while self.n_iter > 0:
+                if self.n_iter != self.first_iter and self.verbosity:
+                    print(f"{self._system_datetime} Update particles' velocities.")
+
+                # move the particles and keep them as valid probabilities.
+                particles += velocities
+                np.clip(particles, 0, 1, out=particles)
+
+                iteration_thresholds = None if thresholds is None else thresholds[self.first_iter - self.n_iter]
+                results, current_best, current_best_particle = self._evaluate_performance(
+                    X, y, particles, iteration_thresholds
+                )
+                pbest_x, _ = self._update_personal_best(results, particles)
+                global_best, global_best_particle = self._update_global_best(
+                    current_best, current_best_particle, global_best, global_best_particle
+                )
+                # until any particle has selected a feature there is no global best, so the social term
+                # pulls each particle towards its own best position instead.
+                gbest_x = pbest_x if global_best_particle is None else pbest_x[global_best_particle[0]]
+                velocities = self._calculate_velocities(particles, velocities, pbest_x, gbest_x)
+
+                if self.verbosity:
+                    print(f"{self._system_datetime} Iteration {self.first_iter - self.n_iter} is done.")
+
+                self.n_iter -= 1
+
+        # if no particle has ever selected a feature, 'best_score_', 'best_features_' and 'best_proba_' stay None.
+        if global_best_particle is None:
+            return
+
+        # the selected features are only unpacked for the best particle.
+        best_features = self._decode_subset(global_best_particle[1], particles.shape[1])
+        self.best_proba_ = self.pbest_x[global_best_particle[0]][list(best_features)].tolist()
+        self.best_features_ = best_features
         self.best_score_ = global_best